@@ -22,26 +22,56 @@ the mainly steps are as follows:
 import numpy as np
 import matplotlib.pyplot as plt
 import math
-import random
 
+try:
+    import numba
+except ImportError:
+    # numba is not available, fall back to the numpy implementation.
+    numba = None
 
-def normalize(angle):
-    while angle > math.pi:
-        angle -= 2 * math.pi
-    while angle < -math.pi:
-        angle += math.pi * 2
-    return angle
+if numba is not None:
+    from fast_slam_kernels import update_all, step_all, systematic_resample, gather_all
+else:
+    update_all = None
+    step_all = None
+    systematic_resample = None
+    gather_all = None
+
+
+def normalize_vec(angle):
+    """
+    wrap an array of angles into [-pi, pi)
+    """
+    return np.remainder(angle + np.pi, 2 * np.pi) - np.pi
+
+
+def _inv2(P):
+    """
+    closed-form inverse and determinant of 2x2 matrices, [[d, -b], [-c, a]] / (a * d - b * c)
+    :param P: [..., 2, 2]
+    :return: inv [..., 2, 2], det [...]
+    """
+    a, b, c, d = P[..., 0, 0], P[..., 0, 1], P[..., 1, 0], P[..., 1, 1]
+    det = a * d - b * c
+    inv = np.empty_like(P)
+    inv[..., 0, 0] = d / det
+    inv[..., 0, 1] = -b / det
+    inv[..., 1, 0] = -c / det
+    inv[..., 1, 1] = a / det
+    return inv, det
 
 
 class Room(object):
     def __init__(self):
         self.landmarks = []
+        self._lm = np.zeros((0, 2))
 
     def add_landmark(self, x, y):
         self.landmarks.append([x, y])
+        self._lm = np.asarray(self.landmarks, dtype=np.float64)
 
     def get_landmarks_as_matrix(self):
-        return np.matrix(self.landmarks).T
+        return np.array(self.landmarks).T
 
     def get_landmarks(self):
         return self.landmarks
@@ -63,35 +93,37 @@ class Car(object):
     control vector:
     [v, delta]
     """
-    def __init__(self, x=0, y=0, yaw=0):
+    def __init__(self, x=0, y=0, yaw=0, seed=None):
         self.x = x
         self.y = y
         self.yaw = yaw
         self.v = 0
         self.delta = 0
-        self.process_variance = np.matrix(np.diag([0.1, np.radians(1)])) ** 2
-        self.observe_variance = np.matrix(np.diag([0.1, np.radians(1)])) ** 2
+        self.process_variance = np.array([0.1, np.radians(1)]) ** 2
+        self.observe_variance = np.array([0.1, np.radians(1)]) ** 2
+        self.rng = np.random.default_rng(seed)
 
     def move(self, v=1, delta=np.radians(5), dt=0.1):
         self.x = self.x + v * dt * math.cos(self.yaw)
         self.y = self.y + v * dt * math.sin(self.yaw)
         self.yaw = self.yaw + delta * dt
-        self.v = v + np.random.randn() * self.process_variance[0, 0]
-        self.delta = delta + np.random.randn() * self.process_variance[1, 1]
+        noise = self.rng.standard_normal(2) * self.process_variance
+        self.v = v + noise[0]
+        self.delta = delta + noise[1]
 
     def get_input(self):
         """
-        [a, delta].T
+        [v, delta]
         :return:
         """
-        return np.matrix([self.v, self.delta]).T
+        return np.array([self.v, self.delta])
 
     def get_state(self):
         """
-        [x, y, yaw].T
+        [x, y, yaw]
         :return:
         """
-        return np.matrix([self.x, self.y, self.yaw]).T
+        return np.array([self.x, self.y, self.yaw])
 
     def observe(self, room):
         """
@@ -100,273 +132,339 @@ class Car(object):
         :type room: Room
         :return: [[d, theta, label], ...]
         """
-        observed = []
-        i = 0
-        for lx, ly in room.landmarks:
-            dx = lx - self.x
-            dy = ly - self.y
-            d = math.sqrt(dx * dx + dy * dy)
-            theta = math.atan2(dy, dx)
-            if d < self.OBSERVE_DISTANCE:
-                d = d + np.random.randn() * self.observe_variance[0, 0]
-                theta = theta + np.random.randn() * self.observe_variance[1, 1]
-                observed.append([d, theta, i])
-            i += 1
+        dx = room._lm[:, 0] - self.x
+        dy = room._lm[:, 1] - self.y
+        d = np.hypot(dx, dy)
+        label = np.flatnonzero(d < self.OBSERVE_DISTANCE)
+        noise = self.rng.standard_normal((len(label), 2)) * self.observe_variance
+        return np.column_stack((d[label] + noise[:, 0], np.arctan2(dy[label], dx[label]) + noise[:, 1], label))
 
-        return np.matrix(observed)
 
+class ParticleSet(object):
 
-class Particle:
-
-    def __init__(self, initial_X, landmark_size, landmark_number, weight, copy=False):
+    def __init__(self, initial_X, landmark_size, landmark_number, particle_number, seed=None):
         """
+        all particles are stored as Structure-of-Arrays, each field is one ndarray over the particle axis.
+        X_pose: [RS, P], [x, y, yaw] of each particle, stored column-wise so that one field of all particles is contiguous
+        X_lm: [P, L, LS], landmarks' position of each particle, float32
+        LP: [P, L, LS, LS], landmarks' covariance of each particle, float32
+        seen: [P, L], whether the landmark has been initialized in each particle
+        weight: [P]
+        log_weight: [P], log likelihood of the current observations, accumulated per landmark to avoid underflow.
         :param initial_X:
-        :type initial_X: [x, y, yaw, v]
-        X = [x, y, theta, v, l1_x, l1_y, l2_x, l2_y, ...].T
+        :type initial_X: [x, y, yaw]
+        :param landmark_size:
+        :param landmark_number:
+        :param particle_number:
+        :param seed: seed of the random generator used by predict and resample
         """
-        if not copy:
-            self.RS = len(initial_X)
-            self.LS = landmark_size
-            self.n_landmark = landmark_number
-            self.X = np.zeros((self.RS + self.LS * self.n_landmark, 1))
-            self.X[0: self.RS, :] = np.matrix(initial_X).T
-            self.LP = np.matrix(np.zeros((landmark_number * self.LS, self.LS)))
-            self.M_DIST_H = 2.0
-            self.weight = weight
+        self.RS = len(initial_X)
+        self.LS = landmark_size
+        self.n_landmark = landmark_number
+        self.n_particle = particle_number
+        self.X_pose = np.zeros((self.RS, self.n_particle))
+        self.X_pose[:, :] = np.asarray(initial_X, dtype=np.float64).reshape(-1, 1)
+        # the landmarks are kept in float32 to halve the memory traffic of the update,
+        # the pose stays float64 so the motion accumulation doesn't drift.
+        self.X_lm = np.zeros((self.n_particle, self.n_landmark, self.LS), dtype=np.float32)
+        self.LP = np.zeros((self.n_particle, self.n_landmark, self.LS, self.LS), dtype=np.float32)
+        self.seen = np.zeros((self.n_particle, self.n_landmark), dtype=bool)
+        self.weight = np.zeros(self.n_particle) + 1. / self.n_particle
+        self.log_weight = np.zeros(self.n_particle)
+        self.rng = np.random.default_rng(seed)
+        # back buffers for resample, swapped with the front ones after each resample.
+        self._X_pose_buf = np.empty_like(self.X_pose)
+        self._X_lm_buf = np.empty_like(self.X_lm)
+        self._LP_buf = np.empty_like(self.LP)
+        self._seen_buf = np.empty_like(self.seen)
+        self._indexes = np.empty(self.n_particle, dtype=np.int64)
+
+    def __len__(self):
+        return self.n_particle
 
     def state(self):
-        return self.X[: self.RS, :]
-
-    def make_copy(self):
-        o = Particle(self.X, self.LS, self.n_landmark, self.weight, copy=True)
-        o.RS = self.RS
-        o.LS = self.LS
-        o.n_landmark = self.n_landmark
-        o.X = self.X.copy()
-        o.LP = self.LP.copy()
-        o.weight = self.weight
-        return o
-
-    def _get_nth_landmark_state(self, n):
-        start_pos = self.RS + n * self.LS
-        end_pos = start_pos + self.LS
-        return self.X[start_pos: end_pos, :]
-
-    def _get_nth_landmark_covariance(self, n):
-        start_pos = n * self.LS
-        end_pos = start_pos + self.LS
-        return self.LP[start_pos: end_pos, :]
+        return self.X_pose
+
+    def resample(self, indexes):
+        """
+        gather the chosen particles into the back buffers, then swap the buffers.
+        indexes may contain duplicates, so the gather can't be done in place.
+        the resampled particles all get the uniform weight.
+        :param indexes: index of the chosen particles
+        :return:
+        """
+        if gather_all is not None:
+            gather_all(indexes, self.X_pose, self.X_lm, self.LP, self.seen,
+                       self._X_pose_buf, self._X_lm_buf, self._LP_buf, self._seen_buf)
+        else:
+            np.take(self.X_pose, indexes, axis=1, out=self._X_pose_buf)
+            np.take(self.X_lm, indexes, axis=0, out=self._X_lm_buf)
+            np.take(self.LP, indexes, axis=0, out=self._LP_buf)
+            np.take(self.seen, indexes, axis=0, out=self._seen_buf)
+        self.X_pose, self._X_pose_buf = self._X_pose_buf, self.X_pose
+        self.X_lm, self._X_lm_buf = self._X_lm_buf, self.X_lm
+        self.LP, self._LP_buf = self._LP_buf, self.LP
+        self.seen, self._seen_buf = self._seen_buf, self.seen
+        self.weight.fill(1. / self.n_particle)
 
     def _move_motion(self, u, dt):
         """
 
-        :param u: [a, delta].T
-        :param Q: np.matrix(np.diag([std_a, std_delta]))
+        :param u: [v, delta] of each particle, shape [2, P], overwritten
         :param dt:
         :return:
         """
-        F = np.matrix([[1.0, 0.0, 0],
-                       [0.0, 1.0, 0],
-                       [0.0, 0.0, 1.0],
-                       ])
-        B = np.matrix([[dt * math.cos(self.X[2, 0]), 0.0],
-                       [dt * math.sin(self.X[2, 0]), 0.0],
-                       [0.0, dt]])
-        self.X[0:self.RS, :] = F * self.X[0:self.RS, :] + B * u
-        self.X[2, 0] = normalize(self.X[2, 0])
-
-    def predict(self, u, Q, dt):
+        # u is scaled by dt in place, then x += ds * cos(yaw), y += ds * sin(yaw), yaw += dyaw
+        u *= dt
+        cos_yaw = np.cos(self.X_pose[2])
+        sin_yaw = np.sin(self.X_pose[2])
+        cos_yaw *= u[0]
+        sin_yaw *= u[0]
+        self.X_pose[0] += cos_yaw
+        self.X_pose[1] += sin_yaw
+        self.X_pose[2] = normalize_vec(self.X_pose[2] + u[1])
+
+    def _noisy_input(self, u, Q_diag):
+        """
+        :param u: [v, delta]
+        :param Q_diag: [std_v, std_delta], the diagonal of Q
+        :return: [v, delta] of each particle with noise, shape [2, P]
+        """
+        u_p = self.rng.standard_normal((len(Q_diag), self.n_particle)) * Q_diag[:, None]
+        u_p += u[:, None]
+        return u_p
+
+    def predict(self, u, Q_diag, dt):
         """
         for particles filter, here, we don't need to calculate the covariance.
-        :param u:
-        :param Q:
+        :param u: [v, delta]
+        :param Q_diag: [std_v, std_delta], the diagonal of Q
         :param dt:
         :return:
         """
-        u_p = u + Q * np.matrix(np.random.randn(Q.shape[0])).T
+        u_p = self._noisy_input(u, Q_diag)
         self._move_motion(u_p, dt)
-        return self.X[0:self.RS, :]
+        return self.X_pose
 
-    def update(self, z, R):
+    def update(self, z, R_diag):
         """
 
-        :param z: [[d_1, theta_1],
+        :param z: [[d_1, theta_1, id_1],
                     ...,
-                    [d_i, theta_i],
+                    [d_i, theta_i, id_i],
                     ...,
-                    [d_n, theta_n]]
-        :type z: np.matrix
+                    [d_n, theta_n, id_n]]
         :return:
         """
-        self.weight = 1
-        observed_n = z.shape[0]
-        for i in range(observed_n):
-            self.update_one_landmark(z[i, :].T, R)
+        z = z.reshape(-1, 3)
+        if update_all is not None:
+            update_all(self.X_pose, self.X_lm, self.LP, self.seen, self.log_weight, z, R_diag)
+        else:
+            self.log_weight[:] = 0.0
+            observed_n = z.shape[0]
+            cs = np.column_stack((np.cos(z[:, 1]), np.sin(z[:, 1])))
+            for i in range(observed_n):
+                self.update_one_landmark(z[i, :], R_diag, cs[i])
 
-        return self.X[0:self.RS, :], self.weight
+        self._weight_from_log()
+        return self.X_pose, self.weight
 
-    def update_one_landmark(self, z, R):
+    def step(self, u, Q_diag, z, R_diag, dt):
         """
-        1. search matching landmark
-        2.
-        :param z: [d, theta].T
-        :param R:
+        predict and update in one pass over the particles.
+        :param u: [v, delta]
+        :param Q_diag: [std_v, std_delta], the diagonal of Q
+        :param z: [[d, theta, id], ...]
+        :param R_diag: the diagonal of R
+        :param dt:
         :return:
         """
-        lm_id = int(z[2, 0])
-        if abs(self.X[lm_id * self.LS + self.RS, 0]) < 0.01:
-            self._add_landmark(z, R)
-        else:
-            self._compute_weight(z)
+        if step_all is None:
+            self.predict(u, Q_diag, dt)
+            return self.update(z, R_diag)
 
-            residual, Hx, Hlm, Slm = self._calc_innovation(lm_id, z, R)
-            K = self._get_nth_landmark_covariance(lm_id) * Hlm.T * np.linalg.inv(Slm)
+        u_p = self._noisy_input(u, Q_diag)
+        step_all(self.X_pose, self.X_lm, self.LP, self.seen, self.log_weight, u_p, z.reshape(-1, 3), R_diag, dt)
+        self._weight_from_log()
+        return self.X_pose, self.weight
 
-            start_pos = lm_id * self.LS
-            end_pos = start_pos + self.LS
-            self.X[self.RS+start_pos: self.RS+end_pos, :] = self.X[self.RS+start_pos: self.RS+end_pos, :] + K * residual
-            P = self.LP[start_pos: end_pos, :]
-            self.LP[start_pos: end_pos, :] = P - K * Hlm * P
+    def _weight_from_log(self):
+        w = np.exp(self.log_weight - self.log_weight.max())
+        self.weight[:] = w / w.sum()
 
-    def _compute_weight(self, z):
+    def update_one_landmark(self, z, R_diag, cs):
+        """
+        all particles observe the same landmark, so do the update in one batch.
+        :param z: [d, theta, id]
+        :param R_diag: the diagonal of R
+        :param cs: [cos(theta), sin(theta)]
+        :return:
+        """
+        lm_id = int(z[2])
+        seen = self.seen[:, lm_id]
+        add_idx = np.flatnonzero(~seen)
+        upd_idx = np.flatnonzero(seen)
+        if len(add_idx) > 0:
+            self._add_landmark(z, R_diag, cs, add_idx)
+        if len(upd_idx) > 0:
+            self._compute_weight(z, cs, upd_idx)
+
+            residual, Hlm, Slm = self._calc_innovation(lm_id, z, R_diag, upd_idx)
+            invS, _ = _inv2(Slm)
+            P = self.LP[upd_idx, lm_id]
+            K = P @ Hlm.transpose(0, 2, 1) @ invS
+
+            self.X_lm[upd_idx, lm_id] += (K @ residual[:, :, None])[:, :, 0]
+            self.LP[upd_idx, lm_id] = P - K @ Hlm @ P
+
+    def _compute_weight(self, z, cs, idx):
         """
         measure the probability of residual between observed and calculated
         :param z:
+        :param cs: [cos(theta), sin(theta)]
+        :param idx: index of particles
         :return:
         """
-        lm_id = int(z[2, 0])
-        X_L = [self.X[0, 0] + z[0, 0] * math.cos(z[1, 0]), self.X[1, 0] + z[0, 0] * math.sin(z[1, 0])]
-        X_L = np.matrix(X_L).T
-        residual = X_L - self._get_nth_landmark_state(lm_id)
-        P = self._get_nth_landmark_covariance(lm_id)
-        try:
-            invP = np.linalg.inv(P)
-        except np.linalg.linalg.LinAlgError:
-            return
-        num = math.exp(-0.5 * residual.T * invP * residual)
-        den = 2.0 * math.pi * math.sqrt(np.linalg.det(P))
-        self.weight = self.weight * num / den
-
-    def _add_landmark(self, z, R):
+        lm_id = int(z[2])
+        X_L = self.X_pose[:2, idx].T + z[0] * cs
+        residual = X_L - self.X_lm[idx, lm_id]
+        invP, det = _inv2(self.LP[idx, lm_id])
+        r0 = residual[:, 0]
+        r1 = residual[:, 1]
+        md = r0 * (invP[:, 0, 0] * r0 + invP[:, 0, 1] * r1) + r1 * (invP[:, 1, 0] * r0 + invP[:, 1, 1] * r1)
+        # skip the particles whose landmark covariance is singular
+        valid = det > 0
+        self.log_weight[idx[valid]] += -0.5 * md[valid] - math.log(2.0 * math.pi) - 0.5 * np.log(det[valid])
+
+    def _add_landmark(self, z, R_diag, cs, idx):
         """
         :param z:
-        :param R:
+        :param R_diag: the diagonal of R
+        :param cs: [cos(theta), sin(theta)]
+        :param idx: index of particles
         :return:
         """
-        X_L = [self.X[0, 0] + z[0, 0] * math.cos(z[1, 0]), self.X[1, 0] + z[0, 0] * math.sin(z[1, 0])]
-        X_L = np.matrix(X_L).T
-        start_pos = int(z[2, 0]) * self.LS + self.RS
-        end_pos = start_pos + self.LS
-        self.X[start_pos: end_pos] = X_L
+        c, s = cs
+        lm_id = int(z[2])
+        self.X_lm[idx, lm_id] = self.X_pose[:2, idx].T + z[0] * cs
+        self.seen[idx, lm_id] = True
         # X_LM = H(R, z)
         # so, P = G_R * P_R_R * G_R.T + G_z * R * G_z.T
-        G_r = np.matrix([[math.cos(z[1,0]), -z[0,0] * math.sin(z[1, 0])],
-                         [math.sin(z[1, 0]), z[0, 0] * math.cos(z[1, 0])]])
-        P = G_r * R * G_r.T
-        start_pos = int(z[2, 0]) * self.LS
-        end_pos = start_pos + self.LS
-        self.LP[start_pos: end_pos, :] = P
-
-    def _calc_innovation(self, n, z_observed, R):
-        lm_real = self._get_nth_landmark_state(n)
-        dx = lm_real[0, 0] - self.X[0, 0]
-        dy = lm_real[1, 0] - self.X[1, 0]
+        G_r = np.array([[c, -z[0] * s],
+                        [s, z[0] * c]])
+        self.LP[idx, lm_id] = (G_r * R_diag) @ G_r.T
+
+    def _calc_innovation(self, n, z_observed, R_diag, idx):
+        lm_real = self.X_lm[idx, n]
+        dx = lm_real[:, 0] - self.X_pose[0, idx]
+        dy = lm_real[:, 1] - self.X_pose[1, idx]
         square_distance = dx * dx + dy * dy
-        z = np.matrix([math.sqrt(square_distance), math.atan2(dy, dx)]).T
-        residual = z_observed[:2, :] - z
-        residual[1, 0] = normalize(residual[1, 0])
-
-        Hx, Hlm = self._observation_jacob(square_distance, z[0, 0], dx, dy)
-        Slm = Hlm * self._get_nth_landmark_covariance(n) * Hlm.T + R
-        return residual, Hx, Hlm, Slm
+        distance = np.sqrt(square_distance)
+        residual = z_observed[:2] - np.column_stack((distance, np.arctan2(dy, dx)))
+        residual[:, 1] = normalize_vec(residual[:, 1])
+
+        Hlm = self._observation_jacob(square_distance, distance, dx, dy)
+        # Slm = Hlm * P * Hlm.T + diag(R_diag), written out element-wise
+        P = self.LP[idx, n]
+        h00, h01, h10, h11 = Hlm[:, 0, 0], Hlm[:, 0, 1], Hlm[:, 1, 0], Hlm[:, 1, 1]
+        a00 = P[:, 0, 0] * h00 + P[:, 0, 1] * h01
+        a01 = P[:, 0, 0] * h10 + P[:, 0, 1] * h11
+        a10 = P[:, 1, 0] * h00 + P[:, 1, 1] * h01
+        a11 = P[:, 1, 0] * h10 + P[:, 1, 1] * h11
+        Slm = np.empty_like(Hlm)
+        Slm[:, 0, 0] = h00 * a00 + h01 * a10 + R_diag[0]
+        Slm[:, 0, 1] = h00 * a01 + h01 * a11
+        Slm[:, 1, 0] = h10 * a00 + h11 * a10
+        Slm[:, 1, 1] = h10 * a01 + h11 * a11 + R_diag[1]
+        return residual, Hlm, Slm
 
     def _observation_jacob(self, square_distance, distance, dx, dy):
-        Hx = np.matrix([[-dx / distance, -dy / distance, 0, 0],
-                       [dy / square_distance, -dx / square_distance, 0, 0]])
-        Hlm = np.matrix([[dx / distance, dy / distance],
-                         [-dy / square_distance, dx / square_distance]])
-        return Hx, Hlm
+        n = len(dx)
+        Hlm = np.empty((n, 2, 2))
+        Hlm[:, 0, 0] = dx / distance
+        Hlm[:, 0, 1] = dy / distance
+        Hlm[:, 1, 0] = -dy / square_distance
+        Hlm[:, 1, 1] = dx / square_distance
+        return Hlm
 
 
 def normalize_particles(particles):
-    ws = 0
-    for p in particles:
-        ws += p.weight
-    try:
-        ws = 1. / ws
-        for p in particles:
-            p.weight *= ws
-    except ZeroDivisionError:
-        for p in particles:
-            p.weight = 1. / len(particles)
+    ws = particles.weight.sum()
+    if ws == 0:
+        particles.weight[:] = 1. / len(particles)
+    else:
+        particles.weight *= 1. / ws
 
 
 def estimate_pose(particles):
-    X = np.zeros((3, 1))
-    for p in particles:
-        X += p.weight * p.state()
-    return X
+    return particles.X_pose @ particles.weight
 
 
 def resample(particles):
     """
     :param particles:
+    :type particles: ParticleSet
     :return:
     """
     normalize_particles(particles)
-    weights = []
-    for particle in particles:
-        weights.append(particle.weight)
-    weights = np.matrix(weights)
-    Neff = 1. / ((weights * weights.T)[0,0] + 1e-30)
+    weights = particles.weight
+    Neff = 1. / (weights.dot(weights) + 1e-30)
     if Neff < len(particles) / 2:
-        wcum = np.cumsum(weights)
-        wcum[0, -1] = 1
-
-        resample_id = []
-        for i in range(len(particles)):
-            resample_id.append(random.uniform(0, 1.0))
-        indexes = []
-        for i in range(len(particles)):
-            ind = 0
-            while wcum[0, ind] < resample_id[i]:
-                ind += 1
-            indexes.append(ind)
-        new_particles = []
-        for i, ind in enumerate(indexes):
-            new_particles.append(particles[ind].make_copy())
-        particles = new_particles
-        normalize_particles(particles)
+        # systematic resample, one random offset and P evenly spaced positions.
+        P = len(particles)
+        u = particles.rng.uniform(0, 1.)
+        if systematic_resample is not None:
+            indexes = particles._indexes
+            systematic_resample(weights, u, indexes)
+        else:
+            wcum = np.cumsum(weights)
+            wcum[-1] = 1.
+            indexes = np.searchsorted(wcum, (u + np.arange(P)) / float(P))
+        particles.resample(indexes)
     return particles
 
 
-def predict(particles, u, Q, dt=0.1):
+def predict(particles, u, Q_diag, dt=0.1):
     """
-    each particle does predict, and return the predict state.
+    all particles do predict, and return the predict state.
     :param particles:
+    :type particles: ParticleSet
     :param u:
-    :param Q:
+    :param Q_diag: [std_v, std_delta], the diagonal of Q
     :param dt:
     :return:
     """
-    RS = particles[0].RS
-    X_pred = np.zeros((RS, 1))
-    for particle in particles:
-        X = particle.predict(u, Q, dt)
-        X_pred = X_pred + X * particle.weight
-    return X_pred
+    particles.predict(u, Q_diag, dt)
+    return estimate_pose(particles)
+
+
+def update(particles, z, R_diag):
+    """
+    all particles do update
+    :param particles:
+    :type particles: ParticleSet
+    :param z:
+    :param R_diag: the diagonal of R
+    :return:
+    """
+    particles.update(z, R_diag)
+    particles = resample(particles)
+    return estimate_pose(particles), particles
 
 
-def update(particles, z, R):
+def step(particles, u, Q_diag, z, R_diag, dt=0.1):
     """
-    for each particle does update
+    one time step of the filter: predict, update, then resample.
     :param particles:
+    :type particles: ParticleSet
+    :param u:
+    :param Q_diag: [std_v, std_delta], the diagonal of Q
     :param z:
-    :param R:
+    :param R_diag: the diagonal of R
+    :param dt:
     :return:
     """
-    for i, particle in enumerate(particles):
-        particle.update(z, R)
+    particles.step(u, Q_diag, z, R_diag, dt)
     particles = resample(particles)
     return estimate_pose(particles), particles
 
@@ -386,57 +484,47 @@ def main():
     initial_X = [0, 0, 0]
     landmark_size = 2
     p_n = 50
-    weight = 1. / p_n
-    particles = [Particle(initial_X, landmark_size, room.get_number_of_landmarks(), weight) for i in range(p_n)]
-
-    Q = np.matrix(np.diag([0.1, np.radians(1)]))
-    R = np.matrix(np.diag([0.1, np.radians(1)]))
+    particles = ParticleSet(initial_X, landmark_size, room.get_number_of_landmarks(), p_n)
 
-    hxEst = np.matrix(np.zeros((3, 1)))
-    hxTrue = np.matrix(np.zeros((3, 1)))
+    Q_diag = np.array([0.1, np.radians(1)])
+    R_diag = np.array([0.1, np.radians(1)])
 
     dt = 0.1
-    t = 0
-    error = []
-    while t < 50:
-        t += dt
+    n_step = int(round(50 / dt))
+    hxEst = np.zeros((3, n_step + 1))
+    hxTrue = np.zeros((3, n_step + 1))
+    error = np.zeros((n_step, 2))
+
+    # draw the static landmarks once, and update the data of the other artists in the loop.
+    fig, ax = plt.subplots()
+    lm = room.get_landmarks_as_matrix()
+    ax.plot(lm[0, :], lm[1, :], "*k")
+    par_pts, = ax.plot([], [], ".r")
+    line_true, = ax.plot([], [], "-b")
+    line_est, = ax.plot([], [], "-r")
+
+    for k in range(1, n_step + 1):
         car.move(dt=dt)
         u = car.get_input()
         Z = car.observe(room)
-        predict(particles, u, Q, dt)
-        X_est, particles = update(particles, Z, R)
+        X_est, particles = step(particles, u, Q_diag, Z, R_diag, dt)
         X_true = car.get_state()
-        hxEst = np.hstack((hxEst, X_est))
-        hxTrue = np.hstack((hxTrue, car.get_state()))
-        plt.cla()
-
-        error.append((X_est[0, 0] - X_true[0, 0], X_est[1, 0] - X_true[1, 0]))
-        # for i in range(len(Z)):
-        #     plt.plot([X_true[0, 0], Z[i][1]], [X_true[1, 0], z_observed[i][2]], "-k")
-
-        for landmark in room.get_landmarks():
-            plt.plot(landmark[0], landmark[1], "*k")
-
-        par_x = []
-        par_y = []
-        for particle in particles:
-            state = particle.state()
-            par_x.append(state[0,0])
-            par_y.append(state[1, 0])
-        plt.plot(par_x, par_y, ".r")
-
-        plt.plot(np.array(hxTrue[0, :]).flatten(),
-                 np.array(hxTrue[1, :]).flatten(), "-b")
-
-        plt.plot(np.array(hxEst[0, :]).flatten(),
-                 np.array(hxEst[1, :]).flatten(), "-r")
+        hxEst[:, k] = X_est
+        hxTrue[:, k] = X_true
+        error[k - 1] = X_est[:2] - X_true[:2]
+
+        state = particles.state()
+        par_pts.set_data(state[0], state[1])
+        line_true.set_data(hxTrue[0, :k + 1], hxTrue[1, :k + 1])
+        line_est.set_data(hxEst[0, :k + 1], hxEst[1, :k + 1])
+        ax.relim()
+        ax.autoscale_view()
         plt.pause(0.001)
 
-    n = len(error)
-    X_error = [e[0] for e in error]
-    Y_error = [e[1] for e in error]
-    d_error = [ math.sqrt(e[0] * e[0] + e[1] * e[1]) for e in error]
-    ind = range(n)
+    X_error = error[:, 0]
+    Y_error = error[:, 1]
+    d_error = np.hypot(X_error, Y_error)
+    ind = range(n_step)
 
     plt.figure()
     plt.plot(ind, X_error, "b-", label="error_x")
@@ -29,15 +29,13 @@ Notice:
 import numpy as np
 import matplotlib.pyplot as plt
 import math
-import random
 
 
 def normalize(angle):
-    while angle > math.pi:
-        angle -= 2 * math.pi
-    while angle < -math.pi:
-        angle += math.pi * 2
-    return angle
+    """
+    wrap an angle into [-pi, pi], an odd multiple of pi may map to either end.
+    """
+    return math.remainder(angle, 2 * math.pi)
 
 
 class Room(object):
@@ -325,68 +323,47 @@ class ParticleSlam(object):
         self._resample()
         return self._estimate_state()
 
-    def _generate_random(self):
-        rp = []
-        for i in range(self.p_n):
-            rp.append(random.uniform(0, 1))
-        return rp
-
     def _resample(self):
         """
         :return:
         """
         self._normalize()
         need_resample = False
-        try:
-            t = (self.pw.T * self.pw)[0, 0]
-            if t < 1e-6:
-                need_resample=True
-            else:
-                Neff = 1./ t
-                if Neff < self.NTH:
-                    need_resample = True
-        except ZeroDivisionError:
+        t = (self.pw * self.pw).sum()
+        if t < 1e-6:
             need_resample = True
+        else:
+            Neff = 1. / t
+            if Neff < self.NTH:
+                need_resample = True
 
         if need_resample:
             print("do resample")
             wcum = np.cumsum(self.pw)
             wcum[-1] = 1.
 
-            rp = self._generate_random()
             # try to find the more important particles.
-            indexes = []
-            for p in rp:
-                ind = 0
-                while wcum[ind] < p:
-                    ind += 1
-                indexes.append(ind)
+            indexes = np.searchsorted(wcum, np.random.uniform(0, 1, self.p_n))
 
             new_particles = []
             for ind in indexes:
                 new_particles.append(self.particles[ind].make_copy())
 
             self.particles = new_particles
-            self._normalize()
+            self.pw[:] = 1. / self.p_n
 
     def _normalize(self):
         ws = self.pw.sum()
-        try:
-            self.pw = self.pw / ws
-        except ZeroDivisionError:
-            self.pw = np.zeros((self.p_n, 1)) + 1. / self.p_n
+        if ws == 0:
+            self.pw[:] = 1. / self.p_n
+        else:
+            self.pw *= 1. / ws
 
     def _estimate_state(self):
-        X = np.zeros((self.RS, 1))
-        for i, p in enumerate(self.particles):
-            X = X + self.pw[i, 0] * p.X_r
-        return X
+        return self.get_particles_pose() @ self.pw
 
     def get_particles_pose(self):
-        X = np.zeros((3, 0))
-        for p in self.particles:
-            X = np.hstack((X, p.X_r))
-        return X
+        return np.hstack([p.X_r for p in self.particles])
 
 
 def main():
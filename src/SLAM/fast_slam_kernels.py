@@ -0,0 +1,191 @@
+#! venv/bin/python
+# -*- encoding:utf-8 -*-
+
+'''
+numba kernels for fast slam.
+the particles are stored as Structure-of-Arrays (see fast_slam.ParticleSet),
+each kernel loops over the particles in parallel, and the 2x2 linear algebra
+of the landmark ekf is written out as scalar operations.
+'''
+
+import math
+import numpy as np
+from numba import njit, prange
+
+# landmarks are float32, keep the constants float32 so the arithmetic isn't promoted to float64.
+PI = np.float32(math.pi)
+TWO_PI = np.float32(2 * math.pi)
+LOG_TWO_PI = math.log(2 * math.pi)
+
+
+@njit(inline='always')
+def inv2(a, b, c, d):
+    """
+    closed-form inverse and determinant of [[a, b], [c, d]]
+    :return: i00, i01, i10, i11, det
+    """
+    det = a * d - b * c
+    return d / det, -b / det, -c / det, a / det, det
+
+
+@njit(inline='always', fastmath=True)
+def _update_particle(p, X_pose, X_lm, LP, seen, z, R_diag):
+    """
+    ekf update of every observed landmark of the p-th particle.
+    the landmark update is done in float32, only the log weight is accumulated in float64.
+    :return: log weight of the observations
+    """
+    observed_n = z.shape[0]
+    lw = 0.0
+    x = np.float32(X_pose[0, p])
+    y = np.float32(X_pose[1, p])
+    r_d = np.float32(R_diag[0])
+    r_theta = np.float32(R_diag[1])
+    for i in range(observed_n):
+        d = np.float32(z[i, 0])
+        theta = np.float32(z[i, 1])
+        lm_id = int(z[i, 2])
+        c = math.cos(theta)
+        s = math.sin(theta)
+        if not seen[p, lm_id]:
+            # add landmark, P = G_r * diag(R_diag) * G_r.T
+            X_lm[p, lm_id, 0] = x + d * c
+            X_lm[p, lm_id, 1] = y + d * s
+            seen[p, lm_id] = True
+            g00 = c
+            g01 = -d * s
+            g10 = s
+            g11 = d * c
+            t00 = g00 * r_d
+            t01 = g01 * r_theta
+            t10 = g10 * r_d
+            t11 = g11 * r_theta
+            LP[p, lm_id, 0, 0] = t00 * g00 + t01 * g01
+            LP[p, lm_id, 0, 1] = t00 * g10 + t01 * g11
+            LP[p, lm_id, 1, 0] = t10 * g00 + t11 * g01
+            LP[p, lm_id, 1, 1] = t10 * g10 + t11 * g11
+            continue
+
+        lx = X_lm[p, lm_id, 0]
+        ly = X_lm[p, lm_id, 1]
+        p00 = LP[p, lm_id, 0, 0]
+        p01 = LP[p, lm_id, 0, 1]
+        p10 = LP[p, lm_id, 1, 0]
+        p11 = LP[p, lm_id, 1, 1]
+
+        # weight
+        r0 = x + d * c - lx
+        r1 = y + d * s - ly
+        i00, i01, i10, i11, det = inv2(p00, p01, p10, p11)
+        if det > 0:
+            md = r0 * (i00 * r0 + i01 * r1) + r1 * (i10 * r0 + i11 * r1)
+            lw += -0.5 * md - LOG_TWO_PI - 0.5 * math.log(det)
+
+        # innovation
+        dx = lx - x
+        dy = ly - y
+        square_distance = dx * dx + dy * dy
+        distance = math.sqrt(square_distance)
+        r0 = d - distance
+        r1 = (theta - math.atan2(dy, dx) + PI) % TWO_PI - PI
+        h00 = dx / distance
+        h01 = dy / distance
+        h10 = -dy / square_distance
+        h11 = dx / square_distance
+
+        # PHt = P * Hlm.T, Slm = Hlm * PHt + diag(R_diag)
+        a00 = p00 * h00 + p01 * h01
+        a01 = p00 * h10 + p01 * h11
+        a10 = p10 * h00 + p11 * h01
+        a11 = p10 * h10 + p11 * h11
+        s00 = h00 * a00 + h01 * a10 + r_d
+        s01 = h00 * a01 + h01 * a11
+        s10 = h10 * a00 + h11 * a10
+        s11 = h10 * a01 + h11 * a11 + r_theta
+        i00, i01, i10, i11, det = inv2(s00, s01, s10, s11)
+
+        # K = PHt * inv(Slm)
+        k00 = a00 * i00 + a01 * i10
+        k01 = a00 * i01 + a01 * i11
+        k10 = a10 * i00 + a11 * i10
+        k11 = a10 * i01 + a11 * i11
+        X_lm[p, lm_id, 0] = lx + k00 * r0 + k01 * r1
+        X_lm[p, lm_id, 1] = ly + k10 * r0 + k11 * r1
+
+        # P = P - K * Hlm * P = P - K * PHt.T
+        LP[p, lm_id, 0, 0] = p00 - (k00 * a00 + k01 * a01)
+        LP[p, lm_id, 0, 1] = p01 - (k00 * a10 + k01 * a11)
+        LP[p, lm_id, 1, 0] = p10 - (k10 * a00 + k11 * a01)
+        LP[p, lm_id, 1, 1] = p11 - (k10 * a10 + k11 * a11)
+    return lw
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def update_all(X_pose, X_lm, LP, seen, log_weight, z, R_diag):
+    """
+    for each particle, do ekf update of every observed landmark and compute the log weight.
+    :param X_pose: [3, P]
+    :param X_lm: [P, L, 2], float32
+    :param LP: [P, L, 2, 2], float32
+    :param seen: [P, L], whether the landmark has been initialized
+    :param log_weight: [P]
+    :param z: [[d, theta, id], ...]
+    :param R_diag: [2], the diagonal of R
+    :return:
+    """
+    for p in prange(X_pose.shape[1]):
+        log_weight[p] = _update_particle(p, X_pose, X_lm, LP, seen, z, R_diag)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def step_all(X_pose, X_lm, LP, seen, log_weight, u, z, R_diag, dt):
+    """
+    one time step of all particles: move with its own input, then update with the observations.
+    :param X_pose: [3, P]
+    :param X_lm: [P, L, 2], float32
+    :param LP: [P, L, 2, 2], float32
+    :param seen: [P, L], whether the landmark has been initialized
+    :param log_weight: [P]
+    :param u: [v, delta] of each particle with noise, shape [2, P]
+    :param z: [[d, theta, id], ...]
+    :param R_diag: [2], the diagonal of R
+    :param dt:
+    :return:
+    """
+    for p in prange(X_pose.shape[1]):
+        yaw = X_pose[2, p]
+        X_pose[0, p] += dt * u[0, p] * math.cos(yaw)
+        X_pose[1, p] += dt * u[0, p] * math.sin(yaw)
+        X_pose[2, p] = (yaw + dt * u[1, p] + math.pi) % (2 * math.pi) - math.pi
+        log_weight[p] = _update_particle(p, X_pose, X_lm, LP, seen, z, R_diag)
+
+
+@njit(parallel=True, cache=True)
+def systematic_resample(w, u, out):
+    """
+    systematic resample, the i-th position is (u + i) / P, and each position is searched independently.
+    :param w: normalized weight [P]
+    :param u: random offset in [0, 1)
+    :param out: [P], index of the chosen particles
+    :return:
+    """
+    n = w.shape[0]
+    wcum = np.cumsum(w)
+    wcum[-1] = 1.0
+    for i in prange(n):
+        out[i] = np.searchsorted(wcum, (u + i) / n)
+
+
+@njit(parallel=True, cache=True)
+def gather_all(indexes, X_pose, X_lm, LP, seen, X_pose_out, X_lm_out, LP_out, seen_out):
+    """
+    copy the chosen particles into the output arrays.
+    :param indexes: [P], index of the chosen particles
+    :return:
+    """
+    for i in prange(indexes.shape[0]):
+        j = indexes[i]
+        X_pose_out[:, i] = X_pose[:, j]
+        X_lm_out[i] = X_lm[j]
+        LP_out[i] = LP[j]
+        seen_out[i] = seen[j]